@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import contextlib
+import io
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+'''Замер времени запуска интерфейса командной строки Individual.py.
+
+Измеряется:
+1. Суммарное время импорта модуля Individual по данным python -X importtime
+   (в отдельном процессе, чтобы кэш модулей не влиял на результат).
+2. Время выполнения main(["select", "-m", "7"]) для уже созданной базы данных.
+3. Время запуска "people --version" в отдельном процессе.
+
+Результаты можно сохранить ключом --json и сравнить с ними следующий
+запуск ключом --baseline, чтобы отслеживать выигрыш со временем.'''
+
+HERE = Path(__file__).resolve().parent
+
+
+def import_time(repeat: int) -> float:
+    '''Лучшее суммарное время импорта Individual в миллисекундах.'''
+    best = None
+    for _ in range(repeat):
+        total = None
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import Individual"],
+            cwd=HERE,
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        # Последняя строка с Individual содержит накопленное время (мкс).
+        for line in result.stderr.splitlines():
+            parts = line.split("|")
+            if len(parts) == 3 and parts[2].strip() == "Individual":
+                total = int(parts[1]) / 1000
+        if total is None:
+            raise RuntimeError(
+                "python -X importtime did not report module Individual")
+        best = total if best is None else min(best, total)
+    return best
+
+
+def version_time(repeat: int) -> float:
+    '''Лучшее время выполнения "Individual.py --version" в миллисекундах.'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, str(HERE / "Individual.py"), "--version"],
+            capture_output=True,
+            check=True
+        )
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def select_time(repeat: int) -> float:
+    '''Лучшее время выполнения main(["select", "-m", "7"]) в миллисекундах.'''
+    sys.path.insert(0, str(HERE))
+    import Individual as operations
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = str(Path(tmp) / "people.db")
+        operations.main(["add", "--db", db, "-n", "Suzuki", "-s", "Satoru",
+                         "-t", "40000000004", "-b", "2015-07-07"])
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                operations.main(["select", "--db", db, "-m", "7"])
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# Измерение -> подпись в отчёте.
+LABELS = {
+    "import": "import Individual (importtime):",
+    "version": "people --version (process):",
+    "select": "main(select -m 7):",
+}
+
+
+def display_results(results: dict, baseline: dict) -> None:
+    '''Отобразить результаты и их изменение относительно baseline.'''
+    for key, label in LABELS.items():
+        line = "{:<31} {:8.2f} ms".format(label, results[key])
+        if key in baseline:
+            change = results[key] - baseline[key]
+            line += "  (baseline {:8.2f} ms, {:+.2f} ms, {:+.1f}%)".format(
+                baseline[key], change, change / baseline[key] * 100)
+        print(line)
+
+
+def main(command_line=None):
+    parser = argparse.ArgumentParser("benchmark_startup")
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        action="store",
+        type=int,
+        default=10,
+        help="How many times to repeat each measurement."
+    )
+    parser.add_argument(
+        "--json",
+        action="store",
+        required=False,
+        help="Save the results to this JSON file."
+    )
+    parser.add_argument(
+        "--baseline",
+        action="store",
+        required=False,
+        help="Compare the results with a JSON file saved by --json."
+    )
+    args = parser.parse_args(command_line)
+
+    results = {
+        "import": import_time(args.repeat),
+        "version": version_time(args.repeat),
+        "select": select_time(args.repeat),
+    }
+    baseline = {}
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    display_results(results, baseline)
+    if args.json:
+        Path(args.json).write_text(
+            json.dumps(results, indent=4), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,124 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import argparse
-import sqlite3
-import typing as t
+from __future__ import annotations
+
+import sys
 from pathlib import Path
 
+# argparse, sqlite3 и typing импортируются лениво: простые команды
+# (например, --version) не должны платить за их загрузку.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    import sqlite3
+    import typing as t
+
 
 '''Данные о людях хранятся в файле, создаваемом при помощи SQLite3 – people.db.
 По умолчанию, файл создаётся в домашнем каталоге пользователя.
 В данном файле имеется две таблицы – people и surnames'''
 
+VERSION = "0.1.0"
+# Версия схемы хранится в PRAGMA user_version файла базы данных.
+# Увеличивать при каждом изменении DDL в create_db.
+SCHEMA_VERSION = 2
+
+# Сколько секунд ждать, пока другой процесс освободит базу данных.
+BUSY_TIMEOUT = 5.0
+# Сколько раз повторить запись, если база всё ещё заблокирована.
+WRITE_RETRIES = 5
+# Начальная пауза между повторами в секундах, удваивается с каждой попыткой.
+RETRY_DELAY = 0.05
+# Сколько записей накапливать в журнале перед сбросом в базу данных.
+SPOOL_BATCH = 100
+# Запас в секундах сверх наибольшей длительности сброса, после которого
+# захваченные, но не сброшенные записи считаются оставшимися от упавшего
+# процесса и возвращаются в журнал.
+SPOOL_STALE = 300.0
+
+
+def connect(database_path: Path,
+            timeout: float = BUSY_TIMEOUT) -> sqlite3.Connection:
+    '''Открыть соединение с базой данных.'''
+    import sqlite3
+
+    return sqlite3.connect(database_path, timeout=timeout)
+
+
+def _is_locked(error: Exception) -> bool:
+    '''Проверить, вызвана ли ошибка блокировкой базы другим процессом.'''
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def write_transaction(
+    database_path: Path,
+    operation: t.Callable[[sqlite3.Cursor], t.Any],
+    timeout: float = BUSY_TIMEOUT,
+    retries: int = WRITE_RETRIES,
+    on_retry: t.Optional[t.Callable[[Exception], None]] = None,
+) -> t.Any:
+    '''Выполнить operation(cursor) в транзакции BEGIN IMMEDIATE.
+    Если база заблокирована другим процессом, попытка повторяется
+    с экспоненциально растущей паузой. Перед каждым повтором
+    вызывается on_retry(error).'''
+    import random
+    import sqlite3
+    import time
+
+    delay = RETRY_DELAY
+    for attempt in range(retries + 1):
+        # isolation_level=None - транзакциями управляем сами.
+        conn = connect(database_path, timeout)
+        conn.isolation_level = None
+        try:
+            cursor = conn.cursor()
+            # Блокировка на запись берётся сразу, а не при первом INSERT,
+            # поэтому транзакция не может упасть посередине из-за
+            # другого писателя.
+            cursor.execute("BEGIN IMMEDIATE")
+            result = operation(cursor)
+            cursor.execute("COMMIT")
+            return result
+        except sqlite3.OperationalError as error:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            if not _is_locked(error) or attempt == retries:
+                raise
+            if on_retry is not None:
+                on_retry(error)
+        finally:
+            conn.close()
+        # Случайный множитель разводит процессы, ожидающие одновременно.
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay *= 2
+
+
+def schema_version(database_path: Path) -> int:
+    '''Получить версию схемы, записанную в базе данных.'''
+    conn = connect(database_path)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.close()
+    return version
+
+
+def ensure_db(database_path: Path) -> bool:
+    '''Создать базу данных, только если файл новый или схема устарела.
+    Возвращает True, если DDL был выполнен.'''
+    if database_path.exists() and \
+            schema_version(database_path) >= SCHEMA_VERSION:
+        return False
+    create_db(database_path)
+    return True
+
 
 def create_db(database_path: Path) -> None:
     '''Создать базу данных.'''
-    conn = sqlite3.connect(database_path)
+    conn = connect(database_path)
     cursor = conn.cursor()
+    # Режим WAL: читатели не блокируют писателя и наоборот.
+    # Режим сохраняется в самом файле базы данных.
+    cursor.execute("PRAGMA journal_mode = WAL")
     # Создать таблицу с информацией о фамилиях.
     cursor.execute(
         '''
@@ -38,6 +141,9 @@ def create_db(database_path: Path) -> None:
         )
         '''
     )
+    # Запомнить версию схемы, чтобы не выполнять DDL при каждом запуске.
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
     conn.close()
 
 
@@ -62,10 +168,10 @@ def display_people(people):
         print("There are no people in list!")
 
 
-def new_human(database_path: Path, name: str, surname: str, telephone: str, birthday: str) -> None:
-    '''Добавить данные о человеке.'''
-    conn = sqlite3.connect(database_path)
-    cursor = conn.cursor()
+def insert_human(cursor: sqlite3.Cursor, name: str, surname: str,
+                 telephone: str, birthday: str) -> None:
+    '''Добавить данные о человеке в рамках открытой транзакции,
+    например внутри write_transaction.'''
     # Получить идентификатор фамилии в базе данных.
     # Если такой записи нет, то добавить информацию о новой фамилии.
     cursor.execute(
@@ -94,13 +200,213 @@ def new_human(database_path: Path, name: str, surname: str, telephone: str, birt
         ''',
         (name, surname_id, telephone, birthday)
     )
-    conn.commit()
-    conn.close()
+
+
+def new_human(
+    database_path: Path,
+    name: str,
+    surname: str,
+    telephone: str,
+    birthday: str,
+    timeout: float = BUSY_TIMEOUT,
+    retries: int = WRITE_RETRIES,
+    on_retry: t.Optional[t.Callable[[Exception], None]] = None,
+) -> None:
+    '''Добавить данные о человеке.'''
+    write_transaction(
+        database_path,
+        lambda cursor: insert_human(
+            cursor, name, surname, telephone, birthday),
+        timeout,
+        retries,
+        on_retry
+    )
+
+
+def spool_path(database_path: Path) -> Path:
+    '''Каталог журнала отложенных записей для базы данных.'''
+    return database_path.with_name(database_path.name + ".spool")
+
+
+def spool_human(database_path: Path, name: str, surname: str,
+                telephone: str, birthday: str) -> int:
+    '''Записать человека в локальный журнал для пакетного добавления.
+    Каждая запись - отдельный файл, поэтому журнал могут одновременно
+    пополнять несколько процессов. Возвращает число ожидающих записей.'''
+    import json
+    import os
+    import time
+    import uuid
+
+    spool = spool_path(database_path)
+    spool.mkdir(exist_ok=True)
+    # Время в имени сохраняет порядок добавления при сбросе.
+    stem = "{:020d}-{}".format(time.time_ns(), uuid.uuid4().hex)
+    temporary = spool / (stem + ".tmp")
+    temporary.write_text(
+        json.dumps({
+            "name": name,
+            "surname": surname,
+            "telephone": telephone,
+            "birthday": birthday
+        }),
+        encoding="utf-8"
+    )
+    # Файл появляется в журнале только целиком.
+    os.replace(temporary, spool / (stem + ".json"))
+    return sum(1 for _ in spool.glob("*.json"))
+
+
+def _read_spooled(path: Path) -> t.Optional[t.Dict[str, str]]:
+    '''Прочитать запись журнала. Возвращает None, если она повреждена.'''
+    import json
+
+    try:
+        human = json.loads(path.read_text(encoding="utf-8"))
+    except ValueError:
+        return None
+    fields = ("name", "surname", "telephone", "birthday")
+    if not isinstance(human, dict) or \
+            not all(isinstance(human.get(field), str) for field in fields):
+        return None
+    return human
+
+
+def _release(claim: Path, spool: Path) -> None:
+    '''Вернуть захваченные записи из каталога claim в журнал.'''
+    import os
+
+    try:
+        claimed = list(claim.iterdir())
+    except FileNotFoundError:
+        # Каталог уже освободил другой процесс.
+        return
+    for path in claimed:
+        try:
+            os.rename(path, spool / path.name)
+        except FileNotFoundError:
+            # Запись уже вернул другой процесс.
+            continue
+    try:
+        claim.rmdir()
+    except OSError:
+        pass
+
+
+def _claim_deadline(timeout: float, retries: int) -> float:
+    '''Момент, до которого сброс с такими timeout и retries обязан
+    завершиться, если процесс жив.'''
+    import time
+
+    # Каждая попытка ждёт не дольше timeout, паузы между попытками -
+    # не дольше полуторной RETRY_DELAY * 2 ** attempt.
+    backoff = sum(1.5 * RETRY_DELAY * 2 ** attempt
+                  for attempt in range(retries))
+    return time.time() + (retries + 1) * timeout + backoff + SPOOL_STALE
+
+
+def _recover_claims(spool: Path) -> None:
+    '''Вернуть в журнал записи, захваченные процессом, который упал
+    до завершения сброса.'''
+    import time
+
+    now = time.time()
+    for claim in spool.glob("claimed-*"):
+        # Срок захвата записан в имени каталога: claimed-<срок>-<uuid>.
+        # Только так другой процесс узнает, сколько ждёт владелец.
+        deadline = claim.name.split("-")[1]
+        try:
+            if deadline.isdigit() and now < int(deadline):
+                continue
+            if not deadline.isdigit() and \
+                    now < claim.stat().st_mtime + SPOOL_STALE:
+                continue
+            _release(claim, spool)
+        except FileNotFoundError:
+            continue
+
+
+def flush_spool(
+    database_path: Path,
+    timeout: float = BUSY_TIMEOUT,
+    retries: int = WRITE_RETRIES,
+    on_retry: t.Optional[t.Callable[[Exception], None]] = None,
+) -> int:
+    '''Добавить все записи журнала в базу данных одной транзакцией.
+    Повреждённые записи переносятся в каталог rejected журнала.
+    Возвращает число добавленных людей.'''
+    import os
+    import uuid
+
+    spool = spool_path(database_path)
+    if not spool.is_dir():
+        return 0
+    _recover_claims(spool)
+    # Захватить записи переносом в собственный каталог: если журнал
+    # одновременно сбрасывают несколько процессов, каждая запись
+    # достанется одному.
+    claim = spool / "claimed-{:.0f}-{}".format(
+        _claim_deadline(timeout, retries), uuid.uuid4().hex)
+    claim.mkdir()
+    for path in sorted(spool.glob("*.json")):
+        try:
+            os.rename(path, claim / path.name)
+        except FileNotFoundError:
+            continue
+    claimed = sorted(claim.iterdir())
+    if not claimed:
+        claim.rmdir()
+        return 0
+
+    rejected = 0
+    try:
+        people = []
+        for path in claimed:
+            human = _read_spooled(path)
+            if human is None:
+                # Одна повреждённая запись не должна задерживать остальные.
+                (spool / "rejected").mkdir(exist_ok=True)
+                os.replace(path, spool / "rejected" / path.name)
+                rejected += 1
+            else:
+                people.append(human)
+
+        def insert_all(cursor):
+            for human in people:
+                insert_human(
+                    cursor,
+                    human["name"],
+                    human["surname"],
+                    human["telephone"],
+                    human["birthday"]
+                )
+
+        write_transaction(database_path, insert_all, timeout, retries,
+                          on_retry)
+    except Exception:
+        # Вернуть записи в журнал, чтобы не потерять их.
+        _release(claim, spool)
+        raise
+    # Записи уже в базе данных: если каталог успели освободить, то
+    # удалять больше нечего.
+    for path in claimed:
+        path.unlink(missing_ok=True)
+    try:
+        claim.rmdir()
+    except OSError:
+        pass
+    if rejected:
+        print(
+            "{} unreadable spooled record(s) moved to {}".format(
+                rejected, spool / "rejected"),
+            file=sys.stderr
+        )
+    return len(people)
 
 
 def select_all(database_path: Path) -> t.List[t.Dict[str, t.Any]]:
     '''Выбрать всех людей.'''
-    conn = sqlite3.connect(database_path)
+    conn = connect(database_path)
     cursor = conn.cursor()
     cursor.execute(
         '''
@@ -124,7 +430,7 @@ def select_all(database_path: Path) -> t.List[t.Dict[str, t.Any]]:
 
 def select_by_month(database_path: Path, month: int) -> t.List[t.Dict[str, t.Any]]:
     '''Выбрать людей, родившихся в требуемом месяце.'''
-    conn = sqlite3.connect(database_path)
+    conn = connect(database_path)
     cursor = conn.cursor()
 
     cursor.execute(
@@ -151,32 +457,8 @@ def select_by_month(database_path: Path, month: int) -> t.List[t.Dict[str, t.Any
     ]
 
 
-def main(command_line=None):
-    # Создать родительский парсер для определения имени файла.
-    file_parser = argparse.ArgumentParser(add_help=False)
-    file_parser.add_argument(
-        "--db",
-        action="store",
-        required=False,
-        default=str(Path.home() / "people.db"),
-        help="The database file name"
-    )
-
-    # Создать основной парсер командной строки.
-    parser = argparse.ArgumentParser("people")
-    parser.add_argument(
-        "--version",
-        action="version",
-        version="%(prog)s 0.1.0"
-    )
-    subparsers = parser.add_subparsers(dest="command")
-
-    # Создать субпарсер для добавления человека.
-    add = subparsers.add_parser(
-        "add",
-        parents=[file_parser],
-        help="Add a new human"
-    )
+def _configure_add(add) -> None:
+    '''Настроить субпарсер для добавления человека.'''
     add.add_argument(
         "-n",
         "--name",
@@ -205,20 +487,22 @@ def main(command_line=None):
         required=True,
         help="The human's birthday."
     )
-
-    # Создать субпарсер для отображения всех работников.
-    _ = subparsers.add_parser(
-        "display",
-        parents=[file_parser],
-        help="Display all people."
+    add.add_argument(
+        "--spool",
+        action="store_true",
+        help="Write to the local spool and flush it in batches."
     )
-
-    # Создать субпарсер для выбора работников.
-    select = subparsers.add_parser(
-        "select",
-        parents=[file_parser],
-        help="Select people."
+    add.add_argument(
+        "--batch",
+        action="store",
+        type=int,
+        default=SPOOL_BATCH,
+        help="How many spooled people trigger a flush."
     )
+
+
+def _configure_select(select) -> None:
+    '''Настроить субпарсер для выбора людей.'''
     select.add_argument(
         "-m",
         "--month",
@@ -228,27 +512,129 @@ def main(command_line=None):
         help="The required month."
     )
 
+
+# Команда -> (справка, функция настройки субпарсера).
+# Аргументы добавляются только для той команды, которая была вызвана.
+COMMANDS = {
+    "add": ("Add a new human", _configure_add),
+    "display": ("Display all people.", None),
+    "flush": ("Write spooled people to the database.", None),
+    "select": ("Select people.", _configure_select),
+}
+
+
+def build_parser(command: t.Optional[str] = None):
+    '''Создать парсер командной строки.
+    Полностью настраивается только субпарсер команды command.'''
+    import argparse
+
+    # Создать родительский парсер для определения имени файла.
+    file_parser = argparse.ArgumentParser(add_help=False)
+    file_parser.add_argument(
+        "--db",
+        action="store",
+        required=False,
+        default=str(Path.home() / "people.db"),
+        help="The database file name"
+    )
+    file_parser.add_argument(
+        "--timeout",
+        action="store",
+        type=float,
+        default=BUSY_TIMEOUT,
+        help="Seconds to wait for a locked database."
+    )
+    file_parser.add_argument(
+        "--retries",
+        action="store",
+        type=int,
+        default=WRITE_RETRIES,
+        help="How many times to retry a write to a locked database."
+    )
+
+    # Создать основной парсер командной строки.
+    parser = argparse.ArgumentParser("people")
+    parser.add_argument(
+        "--version",
+        action="version",
+        version="%(prog)s " + VERSION
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    for name, (help_text, configure) in COMMANDS.items():
+        if name != command:
+            # Остальные команды нужны только для вывода справки.
+            subparsers.add_parser(name, help=help_text)
+            continue
+        subparser = subparsers.add_parser(
+            name,
+            parents=[file_parser],
+            help=help_text
+        )
+        if configure is not None:
+            configure(subparser)
+    return parser
+
+
+def main(command_line=None):
+    if command_line is None:
+        command_line = sys.argv[1:]
+    # Быстрый путь: вывести версию без построения парсера.
+    if list(command_line) == ["--version"]:
+        print("people", VERSION)
+        raise SystemExit(0)
+    # Найти вызванную команду: первый аргумент, не являющийся ключом.
+    command = next(
+        (arg for arg in command_line if not arg.startswith("-")), None)
+    parser = build_parser(command)
+
     # Выполнить разбор аргументов командной строки.
     args = parser.parse_args(command_line)
+    if args.command is None:
+        return
     # Получить путь к файлу базы данных.
     db_path = Path(args.db)
-    create_db(db_path)
+    ensure_db(db_path)
     # Добавить человека.
-    if args.command == "add":
-        new_human(
+    if args.command == "add" and args.spool:
+        pending = spool_human(
             db_path,
             args.name,
             args.surname,
             args.telephone,
             args.birthday
         )
+        if pending >= args.batch:
+            import sqlite3
+
+            # Человек уже записан в журнал: если база занята, его
+            # добавит следующий сброс, а повторный add создал бы дубликат.
+            try:
+                flush_spool(db_path, args.timeout, args.retries)
+            except sqlite3.OperationalError as error:
+                print(
+                    "Spool was not flushed ({}), run 'flush' later.".format(
+                        error),
+                    file=sys.stderr
+                )
+    elif args.command == "add":
+        new_human(
+            db_path,
+            args.name,
+            args.surname,
+            args.telephone,
+            args.birthday,
+            args.timeout,
+            args.retries
+        )
+    # Записать накопленных в журнале людей.
+    elif args.command == "flush":
+        flush_spool(db_path, args.timeout, args.retries)
     # Отобразить всех людей.
     elif args.command == "display":
         display_people(select_all(db_path))
     # Выбрать требуемых людей.
     elif args.command == "select":
         display_people(select_by_month(db_path, args.month))
-        pass
 
 
 if __name__ == "__main__":
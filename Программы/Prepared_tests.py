@@ -1,9 +1,17 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import contextlib
+import io
+import os
+import shutil
 import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from unittest import mock
 import Individual as operations
+import Stress_test as stress
 import unittest
 
 
@@ -15,6 +23,13 @@ import unittest
 В данном файле имеется две таблицы – people и surnames'''
 
 
+def add_many(path, count):
+    '''Добавить count людей из отдельного процесса.'''
+    for number in range(count):
+        operations.new_human(path, "Suzuki", "Satoru",
+                             str(number).zfill(11), "2015-07-07")
+
+
 class TestDatabaseOperations(unittest.TestCase):
 
     @classmethod
@@ -37,6 +52,8 @@ class TestDatabaseOperations(unittest.TestCase):
     def tearDown(self):
         '''Метод tearDown вызывается после каждого теста для очистки окружения.
         В данном случае он избавляется от временной базы данных после проведения тестов.'''
+        shutil.rmtree(operations.spool_path(self.store_tests),
+                      ignore_errors=True)
         if self.store_tests.exists():
             conn = sqlite3.connect(self.store_tests)
             conn.close()
@@ -62,6 +79,21 @@ class TestDatabaseOperations(unittest.TestCase):
         # Отключение от базы данных.
         conn.close()
 
+    def test_ensure_db(self):
+        '''Схема создаётся только для нового файла или устаревшей версии.'''
+        print("Ensuring DB schema.")
+        # Новый файл - DDL выполняется и версия схемы записывается.
+        self.assertTrue(operations.ensure_db(self.store_tests))
+        self.assertEqual(operations.schema_version(self.store_tests),
+                         operations.SCHEMA_VERSION)
+        # Актуальная схема - повторного DDL нет.
+        self.assertFalse(operations.ensure_db(self.store_tests))
+        # Устаревшая схема - DDL выполняется снова.
+        conn = sqlite3.connect(self.store_tests)
+        conn.execute("PRAGMA user_version = 0")
+        conn.close()
+        self.assertTrue(operations.ensure_db(self.store_tests))
+
     def test_new_human(self):
         '''Попытка добавления нового человека.'''
         print("New Human.")
@@ -137,6 +169,279 @@ class TestDatabaseOperations(unittest.TestCase):
         self.assertEqual(len(only_one), 1)
         self.assertEqual(only_one[0]["name"], "Angus")
 
+    def test_main_version(self):
+        '''Вывод версии без построения парсера.'''
+        print("Version fast path.")
+        output = io.StringIO()
+        with mock.patch.object(operations, "build_parser") as build, \
+                contextlib.redirect_stdout(output), \
+                self.assertRaises(SystemExit) as exit_info:
+            operations.main(["--version"])
+        build.assert_not_called()
+        self.assertEqual(exit_info.exception.code, 0)
+        self.assertEqual(output.getvalue().strip(),
+                         "people " + operations.VERSION)
+
+    def test_main_command_detection(self):
+        '''Аргументы добавляются только субпарсеру вызванной команды.'''
+        print("Command detection.")
+        with mock.patch.object(operations, "build_parser",
+                               wraps=operations.build_parser) as build, \
+                contextlib.redirect_stdout(io.StringIO()):
+            operations.main(["select", "--db", str(self.store_tests),
+                             "-m", "7"])
+        build.assert_called_once_with("select")
+        # У субпарсера select нет обязательного -m, если вызвана команда add.
+        args = operations.build_parser("add").parse_args(["select"])
+        self.assertEqual(args.command, "select")
+        self.assertFalse(hasattr(args, "month"))
+        with contextlib.redirect_stderr(io.StringIO()), \
+                self.assertRaises(SystemExit):
+            operations.build_parser("select").parse_args(["select"])
+
+    def test_main_read_only_skips_ddl(self):
+        '''Чтение из актуальной базы данных не выполняет DDL.'''
+        print("Read-only commands.")
+        operations.create_db(self.store_tests)
+        for command in (["select", "-m", "7"], ["display"]):
+            with mock.patch.object(operations, "create_db") as create, \
+                    contextlib.redirect_stdout(io.StringIO()):
+                operations.main(command + ["--db", str(self.store_tests)])
+            create.assert_not_called()
+
+    def test_concurrent_writers(self):
+        '''Одновременное добавление людей из нескольких процессов.'''
+        print("Concurrent writers.")
+        operations.create_db(self.store_tests)
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(add_many, self.store_tests, 25)
+                       for _ in range(4)]
+            # result() пробросит "database is locked", если он случится.
+            for future in futures:
+                future.result()
+        self.assertEqual(len(operations.select_all(self.store_tests)), 100)
+
+    def test_spool(self):
+        '''Пакетное добавление людей через журнал.'''
+        print("Spooling people.")
+        operations.create_db(self.store_tests)
+        spool = operations.spool_path(self.store_tests)
+        operations.spool_human(self.store_tests, "Suzuki",
+                               "Satoru", "40000000004", "2015-07-07")
+        pending = operations.spool_human(self.store_tests, "Angus",
+                                         "Bambi", "30403040304", "2011-06-14")
+        # До сброса записи есть только в журнале.
+        self.assertEqual(pending, 2)
+        self.assertEqual(operations.select_all(self.store_tests), [])
+        self.assertEqual(operations.flush_spool(self.store_tests), 2)
+        people = operations.select_all(self.store_tests)
+        self.assertEqual(len(people), 2)
+        # Порядок добавления сохраняется.
+        self.assertEqual(people[0]["name"], "Suzuki")
+        self.assertEqual(people[1]["name"], "Angus")
+        # Журнал пуст, повторный сброс ничего не добавляет.
+        self.assertEqual(list(spool.iterdir()), [])
+        self.assertEqual(operations.flush_spool(self.store_tests), 0)
+
+    def test_stress(self):
+        '''Короткий нагрузочный тест.'''
+        print("Stress test.")
+        report = stress.run(self.store_tests, processes=2, threads=2,
+                            count=20, write_ratio=0.5, rows=50)
+        self.assertEqual(report["failed"], 0)
+        # Каждая операция либо выполнена, либо учтена как ошибка.
+        self.assertEqual(report["total"] + report["locked"], 80)
+        added = report["operations"]["add"]["count"]
+        self.assertEqual(len(operations.select_all(self.store_tests)),
+                         50 + added)
+
+    def test_stress_contention(self):
+        '''Без ожидания и повторов нагрузочный тест видит блокировки.'''
+        print("Stress test without retries.")
+        report = stress.run(self.store_tests, processes=2, threads=4,
+                            count=20, write_ratio=1.0, rows=0,
+                            timeout=0, retries=0)
+        self.assertGreater(report["locked"], 0)
+        self.assertEqual(report["retried"], 0)
+        # Задержки неудачных добавлений тоже попадают в отчёт.
+        self.assertEqual(report["operations"]["add (error)"]["count"],
+                         report["locked"])
+        self.assertEqual(report["total"] + report["locked"], 160)
+        # В базу попали только успешно добавленные люди.
+        self.assertEqual(len(operations.select_all(self.store_tests)),
+                         report["operations"]["add"]["count"])
+
+    def test_stress_cli(self):
+        '''Нагрузочный тест через интерфейс командной строки.'''
+        print("Stress test through the CLI.")
+        report = stress.run(self.store_tests, processes=1, threads=2,
+                            count=10, write_ratio=0.5, rows=10, cli=True)
+        self.assertEqual(report["failed"], 0)
+        self.assertEqual(report["total"] + report["locked"], 20)
+        added = report["operations"]["add"]["count"]
+        self.assertEqual(len(operations.select_all(self.store_tests)),
+                         10 + added)
+
+    def test_percentile(self):
+        '''Процентили по методу ближайшего ранга.'''
+        print("Percentiles.")
+        self.assertEqual(stress.percentile([5, 1, 4, 2, 3], 50), 3)
+        self.assertEqual(stress.percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(stress.percentile([1, 2, 3, 4], 95), 4)
+        values = list(range(1, 151))
+        self.assertEqual(stress.percentile(values, 99), 149)
+        self.assertEqual(stress.percentile(values, 95), 143)
+        self.assertEqual(stress.percentile(values, 0), 1)
+        self.assertEqual(stress.percentile([], 50), 0.0)
+
+    def test_stress_spool(self):
+        '''Сброс журнала отражается в отчёте отдельной операцией.'''
+        print("Stress test with spool.")
+        report = stress.run(self.store_tests, processes=2, threads=2,
+                            count=10, write_ratio=1.0, rows=0, spool=True)
+        self.assertEqual(report["operations"]["flush"]["count"], 40)
+        self.assertIsNotNone(report["flush_elapsed"])
+        self.assertEqual(len(operations.select_all(self.store_tests)), 40)
+
+    def test_spool_bad_record(self):
+        '''Повреждённая запись не блокирует сброс остальных.'''
+        print("Spooling a bad record.")
+        operations.create_db(self.store_tests)
+        spool = operations.spool_path(self.store_tests)
+        operations.spool_human(self.store_tests, "Suzuki",
+                               "Satoru", "40000000004", "2015-07-07")
+        (spool / "0-bad.json").write_text("{not json", encoding="utf-8")
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            self.assertEqual(operations.flush_spool(self.store_tests), 1)
+        # О перенесённой записи сообщается.
+        self.assertIn("1 unreadable", errors.getvalue())
+        self.assertEqual(len(operations.select_all(self.store_tests)), 1)
+        # Повреждённая запись перенесена в rejected, в журнале ничего нет.
+        self.assertEqual(os.listdir(spool / "rejected"), ["0-bad.json"])
+        self.assertEqual(sorted(os.listdir(spool)), ["rejected"])
+
+    def test_spool_failed_flush(self):
+        '''Неудачный сброс возвращает записи в журнал.'''
+        print("Failed spool flush.")
+        # Таблиц нет, поэтому вставка завершится ошибкой.
+        sqlite3.connect(self.store_tests).close()
+        operations.spool_human(self.store_tests, "Suzuki",
+                               "Satoru", "40000000004", "2015-07-07")
+        with self.assertRaises(sqlite3.OperationalError):
+            operations.flush_spool(self.store_tests)
+        spool = operations.spool_path(self.store_tests)
+        self.assertEqual(len(list(spool.glob("*.json"))), 1)
+        self.assertEqual(list(spool.glob("claimed-*")), [])
+        operations.create_db(self.store_tests)
+        self.assertEqual(operations.flush_spool(self.store_tests), 1)
+
+    def test_spool_stale_claim(self):
+        '''Записи, захваченные упавшим процессом, возвращаются в журнал.'''
+        print("Recovering a stale claim.")
+        operations.create_db(self.store_tests)
+        spool = operations.spool_path(self.store_tests)
+        operations.spool_human(self.store_tests, "Suzuki",
+                               "Satoru", "40000000004", "2015-07-07")
+        # Имитация процесса, упавшего после захвата записи.
+        claim = spool / "claimed-dead"
+        claim.mkdir()
+        for path in spool.glob("*.json"):
+            path.rename(claim / path.name)
+        self.assertEqual(operations.flush_spool(self.store_tests), 0)
+        # Старый захват возвращается при следующем сбросе.
+        stale = claim.stat().st_mtime - operations.SPOOL_STALE - 1
+        os.utime(claim, (stale, stale))
+        self.assertEqual(operations.flush_spool(self.store_tests), 1)
+        self.assertEqual(len(operations.select_all(self.store_tests)), 1)
+        self.assertFalse(claim.exists())
+
+    def test_spool_claim_deadline(self):
+        '''Захват возвращается в журнал только после срока из его имени.'''
+        print("Claim deadlines.")
+        operations.create_db(self.store_tests)
+        spool = operations.spool_path(self.store_tests)
+        operations.spool_human(self.store_tests, "Suzuki",
+                               "Satoru", "40000000004", "2015-07-07")
+        live = spool / "claimed-{}-live".format(int(time.time()) + 100)
+        live.mkdir()
+        for path in spool.glob("*.json"):
+            path.rename(live / path.name)
+        # Срок не истёк, даже если каталог давно не менялся.
+        old = time.time() - operations.SPOOL_STALE - 1
+        os.utime(live, (old, old))
+        self.assertEqual(operations.flush_spool(self.store_tests), 0)
+        self.assertTrue(live.exists())
+        dead = spool / "claimed-1-dead"
+        live.rename(dead)
+        self.assertEqual(operations.flush_spool(self.store_tests), 1)
+        self.assertFalse(dead.exists())
+
+    def test_spool_long_flush(self):
+        '''Долгий сброс не отдаёт свои записи другому процессу.'''
+        print("Long spool flush.")
+        operations.create_db(self.store_tests)
+        operations.spool_human(self.store_tests, "Suzuki",
+                               "Satoru", "40000000004", "2015-07-07")
+        original = operations.write_transaction
+        concurrent = []
+
+        def write_later(*args, **kwargs):
+            # Второй сброс запускается, когда первый ждёт базу данных
+            # дольше SPOOL_STALE (timeout=60 с пятью повторами).
+            if not concurrent:
+                later = time.time() + operations.SPOOL_STALE + 60
+                with mock.patch("time.time", return_value=later):
+                    concurrent.append(
+                        operations.flush_spool(self.store_tests))
+            return original(*args, **kwargs)
+
+        with mock.patch.object(operations, "write_transaction",
+                               side_effect=write_later):
+            self.assertEqual(
+                operations.flush_spool(self.store_tests, timeout=60), 1)
+        self.assertEqual(concurrent, [0])
+        self.assertEqual(len(operations.select_all(self.store_tests)), 1)
+
+    def test_main_spool_locked(self):
+        '''Занятая база не мешает add --spool: запись ждёт в журнале.'''
+        print("Spooling to a locked database.")
+        operations.create_db(self.store_tests)
+        conn = sqlite3.connect(self.store_tests, isolation_level=None)
+        conn.execute("BEGIN IMMEDIATE")
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            operations.main(["add", "--spool", "--batch", "1",
+                             "--timeout", "0", "--retries", "0",
+                             "--db", str(self.store_tests), "-n", "Suzuki",
+                             "-s", "Satoru", "-t", "40000000004",
+                             "-b", "2015-07-07"])
+        conn.execute("ROLLBACK")
+        conn.close()
+        self.assertIn("run 'flush' later", errors.getvalue())
+        operations.main(["flush", "--db", str(self.store_tests)])
+        self.assertEqual(len(operations.select_all(self.store_tests)), 1)
+
+    def test_main_spool(self):
+        '''Команды add --spool --batch и flush.'''
+        print("Spooling from the command line.")
+        db = ["--db", str(self.store_tests)]
+        human = ["-s", "Satoru", "-t", "40000000004", "-b", "2015-07-07"]
+        operations.main(["add", "--spool", "--batch", "2", "-n", "Suzuki"]
+                        + human + db)
+        self.assertEqual(operations.select_all(self.store_tests), [])
+        # Вторая запись достигает размера пакета - журнал сбрасывается.
+        operations.main(["add", "--spool", "--batch", "2", "-n", "Angus"]
+                        + human + db)
+        self.assertEqual(len(operations.select_all(self.store_tests)), 2)
+        # Без достижения размера пакета записи сбрасывает команда flush.
+        operations.main(["add", "--spool", "-n", "Wisdom"] + human + db)
+        self.assertEqual(len(operations.select_all(self.store_tests)), 2)
+        operations.main(["flush"] + db)
+        people = operations.select_all(self.store_tests)
+        self.assertEqual([human["name"] for human in people],
+                         ["Suzuki", "Angus", "Wisdom"])
+
 
 if __name__ == '__main__':
     unittest.main()
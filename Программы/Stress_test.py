@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import sys
+import time
+import typing as t
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import Individual as operations
+
+
+'''Нагрузочное тестирование операций по работе с базой данных.
+
+Несколько процессов, в каждом из которых работает несколько потоков,
+одновременно вызывают new_human, select_all и select_by_month для одной
+базы данных. По окончании выводится пропускная способность, задержки
+(p50, p95, p99), число ошибок блокировки и использованная память.
+С ключом --cli операции выполняются через Individual.main(), то есть
+с разбором аргументов, ensure_db и новым соединением на каждый вызов.
+Работает без сети: база данных создаётся во временном каталоге.'''
+
+OPERATIONS = ("add", "select_all", "select_by_month")
+
+
+def percentile(values: t.List[float], percent: float) -> float:
+    '''Процентиль по методу ближайшего ранга.'''
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def max_rss() -> t.Optional[int]:
+    '''Пиковая резидентная память процесса в килобайтах (если доступно).'''
+    try:
+        import resource
+    except ImportError:
+        # Модуль resource есть только в Unix.
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В macOS ru_maxrss измеряется в байтах, в Linux - в килобайтах.
+    if sys.platform == "darwin":
+        rss //= 1024
+    return rss
+
+
+def seed(database_path: Path, rows: int) -> None:
+    '''Заполнить базу данных rows людьми одной транзакцией.'''
+    def insert_all(cursor):
+        for number in range(rows):
+            operations.insert_human(
+                cursor,
+                "Name{}".format(number),
+                "Surname{}".format(number % 100),
+                str(number).zfill(11),
+                "2000-{:02d}-{:02d}".format(number % 12 + 1, number % 28 + 1)
+            )
+
+    operations.write_transaction(database_path, insert_all)
+
+
+def call_cli(name: str, database_path: Path, number: int,
+             timeout: float, retries: int, spool: bool) -> None:
+    '''Выполнить операцию name через интерфейс командной строки.'''
+    options = ["--db", str(database_path)]
+    if name == "add":
+        command = ["add", "-n", "Stress", "-s", "Worker",
+                   "-t", str(number).zfill(11), "-b", "2000-07-07",
+                   "--timeout", str(timeout), "--retries", str(retries)]
+        if spool:
+            command.append("--spool")
+    elif name == "select_all":
+        command = ["display"]
+    else:
+        command = ["select", "-m", str(random.randint(1, 12))]
+    operations.main(command + options)
+
+
+def call_library(name: str, database_path: Path, number: int,
+                 timeout: float, retries: int, spool: bool,
+                 on_retry: t.Callable[[Exception], None]) -> None:
+    '''Выполнить операцию name через функции модуля Individual.'''
+    if name == "add" and spool:
+        operations.spool_human(
+            database_path, "Stress", "Worker",
+            str(number).zfill(11), "2000-07-07")
+    elif name == "add":
+        operations.new_human(
+            database_path, "Stress", "Worker",
+            str(number).zfill(11), "2000-07-07",
+            timeout, retries, on_retry)
+    elif name == "select_all":
+        operations.select_all(database_path)
+    else:
+        operations.select_by_month(database_path, random.randint(1, 12))
+
+
+def worker(database_path: Path, count: int, write_ratio: float,
+           timeout: float, retries: int, spool: bool, cli: bool,
+           results: t.Dict[str, t.Any], lock: threading.Lock) -> None:
+    '''Выполнить count случайных операций и записать их задержки.
+    Задержки неудачных операций учитываются отдельно.'''
+    latencies = {name: [] for name in OPERATIONS}
+    errors = {name: [] for name in OPERATIONS}
+    counters = {"locked": 0, "retried": 0, "failed": 0}
+
+    def on_retry(error):
+        # Блокировка, которую скрыл повтор в write_transaction.
+        counters["retried"] += 1
+
+    try:
+        for number in range(count):
+            if random.random() < write_ratio:
+                name = "add"
+            else:
+                name = random.choice(OPERATIONS[1:])
+            start = time.perf_counter()
+            try:
+                if cli:
+                    call_cli(name, database_path, number, timeout,
+                             retries, spool)
+                else:
+                    call_library(name, database_path, number, timeout,
+                                 retries, spool, on_retry)
+            except sqlite3.OperationalError as error:
+                if operations._is_locked(error):
+                    counters["locked"] += 1
+                else:
+                    counters["failed"] += 1
+            except Exception:
+                counters["failed"] += 1
+            else:
+                latencies[name].append(time.perf_counter() - start)
+                continue
+            # Время, потраченное на ожидание перед ошибкой.
+            errors[name].append(time.perf_counter() - start)
+    finally:
+        # Результаты потока учитываются, даже если он завершился аварийно.
+        with lock:
+            for name in OPERATIONS:
+                results["latencies"][name].extend(latencies[name])
+                results["errors"][name].extend(errors[name])
+            for key, value in counters.items():
+                results[key] += value
+
+
+def run_process(database_path: Path, threads: int, count: int,
+                write_ratio: float, timeout: float, retries: int,
+                spool: bool, cli: bool) -> t.Dict[str, t.Any]:
+    '''Запустить threads потоков в текущем процессе.'''
+    results = {
+        "latencies": {name: [] for name in OPERATIONS},
+        "errors": {name: [] for name in OPERATIONS},
+        "locked": 0,
+        "retried": 0,
+        "failed": 0,
+    }
+    lock = threading.Lock()
+    pool = [
+        threading.Thread(
+            target=worker,
+            args=(database_path, count, write_ratio, timeout, retries,
+                  spool, cli, results, lock)
+        )
+        for _ in range(threads)
+    ]
+    if cli:
+        # Таблицы, которые печатает интерфейс, не нужны в отчёте.
+        stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    # Время по часам системы: его можно сравнивать между процессами.
+    results["started"] = time.time()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results["finished"] = time.time()
+    if cli:
+        sys.stdout.close()
+        sys.stdout = stdout
+    results["max_rss"] = max_rss()
+    return results
+
+
+def summary(values: t.List[float], count: int) -> t.Dict[str, t.Any]:
+    '''Число операций и процентили их задержек.'''
+    return {
+        "count": count,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+
+def run(database_path: Path, processes: int = 2, threads: int = 4,
+        count: int = 100, write_ratio: float = 0.2, rows: int = 1000,
+        timeout: float = operations.BUSY_TIMEOUT,
+        retries: int = operations.WRITE_RETRIES,
+        spool: bool = False, cli: bool = False) -> t.Dict[str, t.Any]:
+    '''Провести нагрузочный тест и вернуть сводку результатов.
+    Время нагрузки считается без запуска процессов; сброс журнала
+    (при spool=True) измеряется отдельно.'''
+    operations.create_db(database_path)
+    seed(database_path, rows)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [
+            executor.submit(run_process, database_path, threads, count,
+                            write_ratio, timeout, retries, spool, cli)
+            for _ in range(processes)
+        ]
+        parts = [future.result() for future in futures]
+    elapsed = max(part["finished"] for part in parts) - \
+        min(part["started"] for part in parts)
+
+    latencies = {name: [] for name in OPERATIONS}
+    errors = {name: [] for name in OPERATIONS}
+    for part in parts:
+        for name in OPERATIONS:
+            latencies[name].extend(part["latencies"][name])
+            errors[name].extend(part["errors"][name])
+    memory = [part["max_rss"] for part in parts
+              if part["max_rss"] is not None]
+    total = sum(len(values) for values in latencies.values())
+    report = {
+        "elapsed": elapsed,
+        "total": total,
+        "throughput": total / elapsed if elapsed else 0.0,
+        "operations": {
+            name: summary(values, len(values))
+            for name, values in latencies.items()
+        },
+        "locked": sum(part["locked"] for part in parts),
+        "retried": sum(part["retried"] for part in parts),
+        "failed": sum(part["failed"] for part in parts),
+        "max_rss": max(memory) if memory else None,
+        "flush_elapsed": None,
+    }
+    for name, values in errors.items():
+        if values:
+            report["operations"][name + " (error)"] = summary(
+                values, len(values))
+    if spool:
+        # Настоящие вставки при работе через журнал выполняет сброс.
+        start = time.perf_counter()
+        flushed = operations.flush_spool(database_path, timeout, retries)
+        report["flush_elapsed"] = time.perf_counter() - start
+        report["operations"]["flush"] = summary(
+            [report["flush_elapsed"]], flushed)
+    return report
+
+
+def display_report(report: t.Dict[str, t.Any]) -> None:
+    '''Отобразить сводку нагрузочного теста.'''
+    line = "├-{}-⫟-{}-⫟-{}-⫟-{}-⫟-{}-┤".format(
+        "-" * 15, "-" * 8, "-" * 10, "-" * 10, "-" * 10)
+    print(line)
+    print("| {:^15} | {:^8} | {:^10} | {:^10} | {:^10} |".format(
+        "Operation", "Count", "p50, ms", "p95, ms", "p99, ms"))
+    print(line)
+    for name, stats in report["operations"].items():
+        print("| {:<15} | {:>8} | {:>10.2f} | {:>10.2f} | {:>10.2f} |".format(
+            name, stats["count"], stats["p50"] * 1000,
+            stats["p95"] * 1000, stats["p99"] * 1000))
+    print(line)
+    print("Operations: {} in {:.2f} s ({:.1f} ops/s)".format(
+        report["total"], report["elapsed"], report["throughput"]))
+    if report["flush_elapsed"] is not None:
+        print("Spool flush: {} people in {:.2f} s".format(
+            report["operations"]["flush"]["count"],
+            report["flush_elapsed"]))
+    print("Lock errors: {}, absorbed by retries: {}, other errors: {}".format(
+        report["locked"], report["retried"], report["failed"]))
+    if report["max_rss"] is not None:
+        print("Peak memory per process: {} KB".format(report["max_rss"]))
+
+
+def main(command_line=None):
+    parser = argparse.ArgumentParser("stress_test")
+    parser.add_argument(
+        "--db",
+        action="store",
+        required=False,
+        help="The database file name (a temporary one by default)."
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        action="store",
+        type=int,
+        default=2,
+        help="Number of worker processes."
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        action="store",
+        type=int,
+        default=4,
+        help="Number of threads in each process."
+    )
+    parser.add_argument(
+        "-n",
+        "--count",
+        action="store",
+        type=int,
+        default=100,
+        help="Number of operations in each thread."
+    )
+    parser.add_argument(
+        "-w",
+        "--write-ratio",
+        action="store",
+        type=float,
+        default=0.2,
+        help="Share of add operations, from 0 to 1."
+    )
+    parser.add_argument(
+        "-r",
+        "--rows",
+        action="store",
+        type=int,
+        default=1000,
+        help="Number of people in the database before the test."
+    )
+    parser.add_argument(
+        "--timeout",
+        action="store",
+        type=float,
+        default=operations.BUSY_TIMEOUT,
+        help="Seconds to wait for a locked database."
+    )
+    parser.add_argument(
+        "--retries",
+        action="store",
+        type=int,
+        default=operations.WRITE_RETRIES,
+        help="Retries of a locked write (0 shows raw contention)."
+    )
+    parser.add_argument(
+        "--spool",
+        action="store_true",
+        help="Add people through the spool instead of direct writes."
+    )
+    parser.add_argument(
+        "--cli",
+        action="store_true",
+        help="Run operations through Individual.main() "
+             "(retries absorbed by the CLI are not counted)."
+    )
+    args = parser.parse_args(command_line)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(args.db) if args.db else Path(tmp) / "stress.db"
+        report = run(
+            db_path,
+            args.processes,
+            args.threads,
+            args.count,
+            args.write_ratio,
+            args.rows,
+            args.timeout,
+            args.retries,
+            args.spool,
+            args.cli
+        )
+    display_report(report)
+
+
+if __name__ == "__main__":
+    main()